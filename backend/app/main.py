@@ -1,15 +1,24 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
+import aiosqlite
+import asyncio
+import hashlib
 import httpx
+import ijson
+from cachetools import LRUCache, TTLCache
+from collections import defaultdict
 import os
 import re
 from dotenv import load_dotenv
-from typing import List, Optional
+from pathlib import Path
+from typing import Optional
 
 load_dotenv()
 
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse)
 
 # Disable CORS. Do not remove this for full-stack development.
 app.add_middleware(
@@ -20,26 +29,94 @@ app.add_middleware(
     allow_headers=["*"],  # Allows all headers
 )
 
-sessions_db = {}
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
+
+sessions_db = LRUCache(maxsize=10_000)
+_sessions_lock = asyncio.Lock()
+
+_GH_STATIC_HEADERS = {
+    "Accept": "application/vnd.github+json",
+    "X-GitHub-Api-Version": "2022-11-28"
+}
+_DEVIN_STATIC_HEADERS = {"Content-Type": "application/json"}
+
+_issues_cache = TTLCache(maxsize=1024, ttl=10)
+_issues_locks = defaultdict(asyncio.Lock)
+
+client: Optional[httpx.AsyncClient] = None
+
+@app.on_event("startup")
+async def startup_http_client():
+    global client
+    client = httpx.AsyncClient(
+        http2=True,
+        timeout=30.0,
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=20)
+    )
+
+@app.on_event("shutdown")
+async def shutdown_http_client():
+    await client.aclose()
+
+CONFIDENCE_SCORES_DB = Path(__file__).resolve().parent.parent / "confidence_scores.db"
+
+scores_db: Optional[aiosqlite.Connection] = None
+_scores_cache = {}
+_scores_lock = asyncio.Lock()
+
+@app.on_event("startup")
+async def startup_scores_db():
+    global scores_db
+    scores_db = await aiosqlite.connect(CONFIDENCE_SCORES_DB)
+    await scores_db.execute(
+        "CREATE TABLE IF NOT EXISTS scores (repo_issue TEXT PRIMARY KEY, confidence INT, plan TEXT)"
+    )
+    await scores_db.commit()
+
+@app.on_event("shutdown")
+async def shutdown_scores_db():
+    await scores_db.close()
+
+async def load_confidence_score(key):
+    cached = _scores_cache.get(key)
+    if cached is not None:
+        return cached
+    async with scores_db.execute(
+        "SELECT confidence, plan FROM scores WHERE repo_issue = ?", (key,)
+    ) as cursor:
+        row = await cursor.fetchone()
+    if row is None:
+        return None
+    entry = {"confidence_score": row[0], "action_plan": row[1]}
+    _scores_cache[key] = entry
+    return entry
+
+async def delete_confidence_score(key):
+    async with _scores_lock:
+        _scores_cache.pop(key, None)
+        await scores_db.execute("DELETE FROM scores WHERE repo_issue = ?", (key,))
+        await scores_db.commit()
+
+async def save_confidence_score(key, confidence_score, action_plan):
+    async with _scores_lock:
+        _scores_cache[key] = {"confidence_score": confidence_score, "action_plan": action_plan}
+        await scores_db.execute(
+            "INSERT OR REPLACE INTO scores (repo_issue, confidence, plan) VALUES (?, ?, ?)",
+            (key, confidence_score, action_plan)
+        )
+        await scores_db.commit()
+
+_CONFIDENCE_RE = re.compile(r'CONFIDENCE:\s*(\d+)', re.IGNORECASE)
+_PLAN_RE = re.compile(r'ACTION PLAN:\s*(.+)', re.IGNORECASE | re.DOTALL)
 
 def parse_confidence_and_plan(text: str):
-    confidence_match = re.search(r'CONFIDENCE:\s*(\d+)', text, re.IGNORECASE)
+    confidence_match = _CONFIDENCE_RE.search(text)
     confidence_score = int(confidence_match.group(1)) if confidence_match else None
-    
-    plan_match = re.search(r'ACTION PLAN:\s*(.+)', text, re.IGNORECASE | re.DOTALL)
+
+    plan_match = _PLAN_RE.search(text)
     action_plan = plan_match.group(1).strip() if plan_match else None
-    
-    return confidence_score, action_plan
 
-class Issue(BaseModel):
-    number: int
-    title: str
-    body: Optional[str]
-    state: str
-    html_url: str
-    created_at: str
-    updated_at: str
-    labels: List[dict]
+    return confidence_score, action_plan
 
 class ScopeRequest(BaseModel):
     repo: str
@@ -54,24 +131,23 @@ class CompleteRequest(BaseModel):
     devin_api_key: str
     session_id: str
 
-class SessionStatus(BaseModel):
-    session_id: str
-    status: str
-    confidence_score: Optional[int] = None
-    action_plan: Optional[str] = None
-
 @app.get("/healthz")
 async def healthz():
     return {"status": "ok"}
 
 @app.get("/api/issues")
 async def get_issues(repo: str, github_token: str):
-    async with httpx.AsyncClient() as client:
-        headers = {
-            "Authorization": f"Bearer {github_token}",
-            "Accept": "application/vnd.github+json",
-            "X-GitHub-Api-Version": "2022-11-28"
-        }
+    cache_key = (repo, hashlib.blake2s(github_token.encode()).digest())
+    cached = _issues_cache.get(cache_key)
+    if cached is not None:
+        return Response(content=cached, media_type="application/json")
+
+    async with _issues_locks[cache_key]:
+        cached = _issues_cache.get(cache_key)
+        if cached is not None:
+            return Response(content=cached, media_type="application/json")
+
+        headers = {**_GH_STATIC_HEADERS, "Authorization": f"Bearer {github_token}"}
         try:
             response = await client.get(
                 f"https://api.github.com/repos/{repo}/issues",
@@ -79,41 +155,36 @@ async def get_issues(repo: str, github_token: str):
                 params={"state": "open"}
             )
             response.raise_for_status()
-            return response.json()
         except httpx.HTTPError as e:
             raise HTTPException(status_code=500, detail=f"GitHub API error: {str(e)}")
 
+        _issues_cache[cache_key] = response.content
+        return Response(content=response.content, media_type="application/json")
+
 @app.post("/api/scope")
 async def scope_issue(request: ScopeRequest):
-    async with httpx.AsyncClient(timeout=30.0) as client:
-        gh_headers = {
-            "Authorization": f"Bearer {request.github_token}",
-            "Accept": "application/vnd.github+json",
-            "X-GitHub-Api-Version": "2022-11-28"
-        }
+    gh_headers = {**_GH_STATIC_HEADERS, "Authorization": f"Bearer {request.github_token}"}
 
-        try:
-            issue_response = await client.get(
-                f"https://api.github.com/repos/{request.repo}/issues/{request.issue_number}",
-                headers=gh_headers
-            )
-            issue_response.raise_for_status()
-            issue_data = issue_response.json()
-        except httpx.HTTPError as e:
-            print(f"GitHub API error: {str(e)}")
-            raise HTTPException(status_code=500, detail=f"GitHub API error: {str(e)}")
+    try:
+        issue_response = await client.get(
+            f"https://api.github.com/repos/{request.repo}/issues/{request.issue_number}",
+            headers=gh_headers
+        )
+        issue_response.raise_for_status()
+        issue_data = issue_response.json()
+    except httpx.HTTPError as e:
+        print(f"GitHub API error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"GitHub API error: {str(e)}")
 
-        devin_headers = {
-            "Authorization": f"Bearer {request.devin_api_key}",
-            "Content-Type": "application/json"
-        }
-        
-        prompt = f"""Please analyze this GitHub issue and provide:
+    devin_headers = {**_DEVIN_STATIC_HEADERS, "Authorization": f"Bearer {request.devin_api_key}"}
+    
+    issue_description = issue_data.get('body', 'No description provided')
+    prompt = f"""Please analyze this GitHub issue and provide:
 1. A confidence score (0-100) indicating how feasible this issue is to complete
 2. A detailed action plan for implementing the solution
 
 Issue: {issue_data['title']}
-Description: {issue_data.get('body', 'No description provided')}
+Description: {issue_description}
 Repository: {request.repo}
 
 Format your response as:
@@ -121,43 +192,66 @@ CONFIDENCE: [score]
 ACTION PLAN:
 [detailed plan]"""
 
-        try:
-            session_response = await client.post(
-                "https://api.devin.ai/v1/sessions",
-                headers=devin_headers,
-                json={
-                    "prompt": prompt,
-                    "repo_path_or_url": f"https://github.com/{request.repo}"
-                }
-            )
-            session_response.raise_for_status()
-            session_data = session_response.json()
-            session_id = session_data["session_id"]
-            
+    try:
+        session_response = await client.post(
+            "https://api.devin.ai/v1/sessions",
+            headers=devin_headers,
+            json={
+                "prompt": prompt,
+                "repo_path_or_url": f"https://github.com/{request.repo}"
+            }
+        )
+        session_response.raise_for_status()
+        session_data = session_response.json()
+        session_id = session_data["session_id"]
+        
+        async with _sessions_lock:
             sessions_db[session_id] = {
                 "repo": request.repo,
                 "issue_number": request.issue_number,
                 "status": "scoping",
                 "type": "scope"
             }
+
+        # A fresh scope session supersedes any score stored for this issue;
+        # drop it so polling waits for the new session's result.
+        await delete_confidence_score(f"{request.repo}#{request.issue_number}")
+
+        return {
+            "session_id": session_id,
+            "status": "scoping",
+            "message": "Devin is analyzing the issue"
+        }
+    except httpx.HTTPError as e:
+        print(f"Devin API error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Devin API error: {str(e)}")
+
+@app.post("/api/complete")
+async def complete_issue(request: CompleteRequest):
+    devin_headers = {**_DEVIN_STATIC_HEADERS, "Authorization": f"Bearer {request.devin_api_key}"}
+    
+    if request.session_id and request.session_id in sessions_db:
+        prompt = "Please proceed with implementing the solution based on the action plan you provided."
+        try:
+            message_response = await client.post(
+                f"https://api.devin.ai/v1/sessions/{request.session_id}/message",
+                headers=devin_headers,
+                json={"message": prompt}
+            )
+            message_response.raise_for_status()
+
+            async with _sessions_lock:
+                sessions_db[request.session_id]["status"] = "implementing"
             
             return {
-                "session_id": session_id,
-                "status": "scoping",
-                "message": "Devin is analyzing the issue"
+                "session_id": request.session_id,
+                "status": "implementing",
+                "message": "Devin is working on completing the issue"
             }
         except httpx.HTTPError as e:
-            print(f"Devin API error: {str(e)}")
             raise HTTPException(status_code=500, detail=f"Devin API error: {str(e)}")
-
-@app.post("/api/complete")
-async def complete_issue(request: CompleteRequest):
-    async with httpx.AsyncClient(timeout=30.0) as client:
-        gh_headers = {
-            "Authorization": f"Bearer {request.github_token}",
-            "Accept": "application/vnd.github+json",
-            "X-GitHub-Api-Version": "2022-11-28"
-        }
+    else:
+        gh_headers = {**_GH_STATIC_HEADERS, "Authorization": f"Bearer {request.github_token}"}
         try:
             issue_response = await client.get(
                 f"https://api.github.com/repos/{request.repo}/issues/{request.issue_number}",
@@ -168,35 +262,11 @@ async def complete_issue(request: CompleteRequest):
         except httpx.HTTPError as e:
             raise HTTPException(status_code=500, detail=f"GitHub API error: {str(e)}")
 
-        devin_headers = {
-            "Authorization": f"Bearer {request.devin_api_key}",
-            "Content-Type": "application/json"
-        }
-        
-        if request.session_id and request.session_id in sessions_db:
-            prompt = "Please proceed with implementing the solution based on the action plan you provided."
-            try:
-                message_response = await client.post(
-                    f"https://api.devin.ai/v1/sessions/{request.session_id}/message",
-                    headers=devin_headers,
-                    json={"message": prompt}
-                )
-                message_response.raise_for_status()
-                
-                sessions_db[request.session_id]["status"] = "implementing"
-                
-                return {
-                    "session_id": request.session_id,
-                    "status": "implementing",
-                    "message": "Devin is working on completing the issue"
-                }
-            except httpx.HTTPError as e:
-                raise HTTPException(status_code=500, detail=f"Devin API error: {str(e)}")
-        else:
-            prompt = f"""Please complete this GitHub issue by implementing the solution and creating a PR.
+        issue_description = issue_data.get('body', 'No description provided')
+        prompt = f"""Please complete this GitHub issue by implementing the solution and creating a PR.
 
 Issue: {issue_data['title']}
-Description: {issue_data.get('body', 'No description provided')}
+Description: {issue_description}
 Repository: {request.repo}
 
 Please:
@@ -205,82 +275,115 @@ Please:
 3. Test your changes
 4. Create a PR with your implementation"""
 
-            try:
-                session_response = await client.post(
-                    "https://api.devin.ai/v1/sessions",
-                    headers=devin_headers,
-                    json={
-                        "prompt": prompt,
-                        "repo_path_or_url": f"https://github.com/{request.repo}"
-                    }
-                )
-                session_response.raise_for_status()
-                session_data = session_response.json()
-                session_id = session_data["session_id"]
-                
+        try:
+            session_response = await client.post(
+                "https://api.devin.ai/v1/sessions",
+                headers=devin_headers,
+                json={
+                    "prompt": prompt,
+                    "repo_path_or_url": f"https://github.com/{request.repo}"
+                }
+            )
+            session_response.raise_for_status()
+            session_data = session_response.json()
+            session_id = session_data["session_id"]
+            
+            async with _sessions_lock:
                 sessions_db[session_id] = {
                     "repo": request.repo,
                     "issue_number": request.issue_number,
                     "status": "implementing",
                     "type": "complete"
                 }
-                
-                return {
-                    "session_id": session_id,
-                    "status": "implementing",
-                    "message": "Devin is working on completing the issue"
-                }
-            except httpx.HTTPError as e:
-                raise HTTPException(status_code=500, detail=f"Devin API error: {str(e)}")
+            
+            return {
+                "session_id": session_id,
+                "status": "implementing",
+                "message": "Devin is working on completing the issue"
+            }
+        except httpx.HTTPError as e:
+            raise HTTPException(status_code=500, detail=f"Devin API error: {str(e)}")
 
 @app.get("/api/session/{session_id}")
 async def get_session_status(session_id: str, devin_api_key: str):
     if session_id not in sessions_db:
         raise HTTPException(status_code=404, detail="Session not found")
-    
-    async with httpx.AsyncClient(timeout=30.0) as client:
-        devin_headers = {
-            "Authorization": f"Bearer {devin_api_key}",
-            "Content-Type": "application/json"
-        }
-        
-        try:
-            response = await client.get(
-                f"https://api.devin.ai/v1/sessions/{session_id}",
-                headers=devin_headers
-            )
-            response.raise_for_status()
-            session_data = response.json()
-            
-            result = {
+
+    session = sessions_db[session_id]
+    if session.get("type") == "scope" and session.get("status") != "implementing":
+        if "confidence_score" not in session:
+            cached = await load_confidence_score(f"{session['repo']}#{session['issue_number']}")
+            if cached:
+                session["confidence_score"] = cached["confidence_score"]
+                session["action_plan"] = cached["action_plan"]
+        if "confidence_score" in session:
+            session["status"] = "finished"
+            return {
                 "session_id": session_id,
-                "status": session_data.get("status", "unknown"),
                 "session_url": f"https://app.devin.ai/sessions/{session_id}",
-                **sessions_db[session_id]
+                "should_poll": False,
+                **session
             }
-            
-            if sessions_db[session_id].get("type") == "scope" and "confidence_score" not in sessions_db[session_id]:
-                try:
-                    all_text = ""
-                    for msg in session_data.get("messages", []):
-                        if msg.get("type") == "devin_message":
-                            all_text += msg.get("message", "") + "\n"
-                    
-                    if all_text:
-                        confidence_score, action_plan = parse_confidence_and_plan(all_text)
-                        if confidence_score is not None:
-                            sessions_db[session_id]["confidence_score"] = confidence_score
-                            sessions_db[session_id]["action_plan"] = action_plan
-                            result["confidence_score"] = confidence_score
-                            result["action_plan"] = action_plan
-                except Exception as e:
-                    print(f"Failed to parse messages: {e}")
-            
-            if "confidence_score" in sessions_db[session_id]:
-                result["confidence_score"] = sessions_db[session_id]["confidence_score"]
-            if "action_plan" in sessions_db[session_id]:
-                result["action_plan"] = sessions_db[session_id]["action_plan"]
-            
-            return result
-        except httpx.HTTPError as e:
-            raise HTTPException(status_code=500, detail=f"Devin API error: {str(e)}")
+
+    devin_headers = {**_DEVIN_STATIC_HEADERS, "Authorization": f"Bearer {devin_api_key}"}
+    
+    try:
+        response = await client.get(
+            f"https://api.devin.ai/v1/sessions/{session_id}",
+            headers=devin_headers
+        )
+        response.raise_for_status()
+        raw = response.content
+        status = next(ijson.items(raw, "status"), "unknown")
+
+        result = {
+            "session_id": session_id,
+            "status": status,
+            "session_url": f"https://app.devin.ai/sessions/{session_id}",
+            **sessions_db[session_id]
+        }
+        
+        if sessions_db[session_id].get("type") == "scope" and "confidence_score" not in sessions_db[session_id]:
+            try:
+                parts = [
+                    msg.get("message", "")
+                    for msg in ijson.items(raw, "messages.item")
+                    if msg.get("type") == "devin_message"
+                ]
+
+                confidence_score, action_plan = None, None
+                for body in reversed(parts):
+                    score, plan = parse_confidence_and_plan(body)
+                    if score is not None and plan is not None:
+                        confidence_score, action_plan = score, plan
+                        break
+                else:
+                    # No single message carries both markers (e.g. the score
+                    # and plan arrived in separate messages); search the
+                    # joined transcript like the original implementation.
+                    confidence_score, action_plan = parse_confidence_and_plan("\n".join(parts))
+
+                if confidence_score is not None:
+                    sessions_db[session_id]["confidence_score"] = confidence_score
+                    sessions_db[session_id]["action_plan"] = action_plan
+                    sessions_db[session_id]["status"] = "finished"
+                    result["confidence_score"] = confidence_score
+                    result["action_plan"] = action_plan
+                    result["status"] = "finished"
+
+                    await save_confidence_score(
+                        f"{sessions_db[session_id]['repo']}#{sessions_db[session_id]['issue_number']}",
+                        confidence_score,
+                        action_plan
+                    )
+            except Exception as e:
+                print(f"Failed to parse messages: {e}")
+        
+        if "confidence_score" in sessions_db[session_id]:
+            result["confidence_score"] = sessions_db[session_id]["confidence_score"]
+        if "action_plan" in sessions_db[session_id]:
+            result["action_plan"] = sessions_db[session_id]["action_plan"]
+        
+        return result
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=500, detail=f"Devin API error: {str(e)}")